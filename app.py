@@ -1,11 +1,19 @@
 import streamlit as st
-from typing import Dict, List
-import json
-from openai import OpenAI
+import asyncio
+from typing import Annotated, Callable, Dict, Final, List, Optional, Tuple, get_args, get_origin
+import orjson
+import httpx
+import ijson
+from openai import AsyncOpenAI, OpenAI, OpenAIError
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
 import pandas as pd
 from datetime import datetime
 import io
-import time
+import queue
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
 # Configuration de la page
 st.set_page_config(
@@ -14,344 +22,650 @@ st.set_page_config(
     layout="wide"
 )
 
+# Piliers ESG : (clé dans la réponse JSON, libellé affiché)
+PILLARS: Tuple[Tuple[str, str], ...] = (
+    ("environnement", "🌍 Environnement"),
+    ("social", "👥 Social"),
+    ("gouvernance", "⚖️ Gouvernance")
+)
+
+# Réglages HTTP partagés par les clients synchrone et asynchrone
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=20)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+# Requêtes (lots d'enjeux) traitées simultanément, pour rester sous les limites de requêtes par minute de l'API
+MAX_CONCURRENT_LOTS = 10
+# Nouvelles tentatives du SDK OpenAI (backoff exponentiel) sur 429, timeouts et erreurs serveur
+MAX_RETRIES = 3
+# Enjeux envoyés par requête : un seul, pour des réponses courtes analysées en parallèle
+ENJEUX_PAR_REQUETE = 1
+
+# Consignes communes à toutes les analyses, envoyées en message système pour former
+# un préfixe identique d'une requête à l'autre, éligible au cache de prompt d'OpenAI.
+# Le format de réponse n'y figure plus : il est imposé par RESPONSE_FORMAT (structured outputs).
+IRO_INSTRUCTIONS: Final[str] = """En tant qu'expert CSRD, analysez TOUS les enjeux mentionnés dans les textes fournis.
+Pour CHAQUE enjeu mentionné, vous devez fournir une analyse complète des impacts, risques et opportunités.
+
+ATTENTION:
+- Vous DEVEZ traiter ABSOLUMENT TOUS les enjeux mentionnés, un élément de "enjeux" par enjeu
+- Pour chaque enjeu, fournissez AU MINIMUM 5 éléments pour chaque catégorie
+- Le nombre d'éléments doit être adapté à l'importance de l'enjeu (jusqu'à 10 par catégorie)
+- Chaque élément doit être détaillé et spécifique à l'enjeu
+- Citez les paragraphes CSRD pour chaque datapoint
+- Ne limitez PAS le nombre d'enjeux traités
+"""
+
+# Premier appel : structure des enjeux
+STRUCTURE_SYSTEM_PROMPT: Final[str] = """Vous êtes un expert en reporting CSRD. Pour chacun des enjeux mentionnés,
+identifiez UNIQUEMENT les grands domaines d'impact, sans les détailler.
+Votre rôle est d'établir une première structure qui sera enrichie ensuite.
+
+""" + IRO_INSTRUCTIONS
+
+# Deuxième appel : enrichissement (et analyse en un seul passage du mode batch)
+ENRICHMENT_SYSTEM_PROMPT: Final[str] = """Vous êtes un expert en reporting CSRD spécialisé dans l'analyse exhaustive.
+RÈGLE ABSOLUE, sous peine de rejet de la réponse : pour chaque catégorie (impacts positifs, impacts négatifs,
+risques, mesures d'atténuation, opportunités, actions proposées), fournissez entre 5 et 10 éléments.
+
+Chaque élément doit être :
+1. Détaillé et explicite (pas de descriptions vagues)
+2. Spécifique à l'enjeu traité
+3. Actionnable et mesurable quand applicable"""
+
+ENRICHMENT_USER_PROMPT: Final[str] = """Enrichissez CHAQUE enjeu en respectant la règle des 5 à 10 éléments par catégorie.
+Les datapoints CSRD doivent TOUS citer les paragraphes de référence de la CSRD."""
+
+# Message système des requêtes batch, sérialisé une seule fois et inséré tel quel dans chaque ligne JSONL
+BATCH_SYSTEM_MESSAGE: Final = orjson.Fragment(orjson.dumps(
+    {"role": "system", "content": ENRICHMENT_SYSTEM_PROMPT + "\n\n" + IRO_INSTRUCTIONS}
+))
+
+USER_PROMPT_TEMPLATE: Final[str] = """PROFIL DE L'ENTREPRISE:
+{company_description}
+
+SECTEUR D'ACTIVITÉ:
+{industry_sector}
+
+MODÈLE D'AFFAIRES:
+{business_model}
+
+CARACTÉRISTIQUES SPÉCIFIQUES:
+{specific_features}
+
+ENJEUX À ANALYSER:
+[IMPORTANT: Analyser TOUS les enjeux de la liste ci-dessous, un enjeu JSON par élément]
+{pilier_label}: {issues}"""
+
+# Relance d'une réponse tronquée par max_tokens
+CONTINUATION_PROMPT: Final[str] = "Poursuivez le JSON exactement là où vous vous êtes arrêté, en ne renvoyant que les caractères manquants."
+MAX_CONTINUATIONS = 2
+# Générations par lot quand ses enjeux ne respectent pas le nombre d'éléments attendu
+MAX_TENTATIVES = 2
+
+@lru_cache(maxsize=32)
+def _build_user_prompt(company_description: str, industry_sector: str, business_model: str,
+                       specific_features: str, pilier: str, issues: str) -> str:
+    """Assemble le message utilisateur d'un pilier, réutilisé tant que la saisie ne change pas"""
+    return USER_PROMPT_TEMPLATE.format(
+        company_description=company_description, industry_sector=industry_sector,
+        business_model=business_model, specific_features=specific_features,
+        pilier_label=pilier.capitalize(), issues=issues
+    )
+
+# Modèle attendu pour chaque enjeu : au moins 5 éléments dans chaque catégorie.
+# Il sert à la fois de format imposé à GPT (structured outputs, schéma strict :
+# tous les champs requis, aucun champ supplémentaire) et de validation des réponses.
+ListeMin5 = Annotated[List[str], Field(min_length=5)]
+Niveau = Annotated[str, Field(description="Élevé/Moyen/Faible")]
+Horizon = Annotated[str, Field(description="Court/Moyen/Long terme")]
+
+class _Strict(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+class Impacts(_Strict):
+    positifs: ListeMin5
+    negatifs: ListeMin5
+
+class Risques(_Strict):
+    liste: ListeMin5
+    niveau: Niveau
+    horizon: Horizon
+    mesures_attenuation: ListeMin5
+
+class Opportunites(_Strict):
+    liste: ListeMin5
+    potentiel: Niveau
+    horizon: Horizon
+    actions_saisie: ListeMin5
+
+class Objectifs(_Strict):
+    court_terme: str = Field(description="Objectif à 1 an")
+    moyen_terme: str = Field(description="Objectif à 3 ans")
+    long_terme: str = Field(description="Objectif à 5 ans")
+
+class Datapoint(_Strict):
+    indicateur: str
+    type: str = Field(description="KPI quantitatif ou texte narratif")
+    reference_csrd: str = Field(description="Paragraphe CSRD correspondant")
+    description: str
+    methodologie: str = Field(description="Méthodologie de collecte/calcul")
+    frequence: str
+    objectifs: Objectifs
+
+class EnjeuModel(_Strict):
+    description: str
+    impacts: Impacts
+    risques: Risques
+    opportunites: Opportunites
+    datapoints_csrd: List[Datapoint]
+
+class EnjeuNomme(EnjeuModel):
+    nom: str = Field(description="Nom de l'enjeu, tel que fourni")
+
+class ReponseIRO(_Strict):
+    enjeux: List[EnjeuNomme]
+
+RESPONSE_FORMAT: Final = {
+    "type": "json_schema",
+    "json_schema": {"name": "analyse_iro", "strict": True, "schema": ReponseIRO.model_json_schema()}
+}
+
+def _par_nom(reponse: dict, enjeux: Tuple[str, ...] = ()) -> dict:
+    """Convertit la réponse {"enjeux": [{"nom": ..., ...}]} en {nom: enjeu}"""
+    par_nom = {}
+    for enjeu in reponse.get("enjeux", []):
+        nom = enjeu.pop("nom", "")
+        # Lot d'un seul enjeu : clé saisie par l'utilisateur, le nom renvoyé pouvant être reformulé ou dupliqué
+        par_nom.setdefault(enjeux[0] if len(enjeux) == 1 else nom, enjeu)
+    return par_nom
+
+# Modèle utilisé par défaut, remplaçable via le secret OPENAI_MODEL
+DEFAULT_MODEL = "gpt-4o-mini"
+
+# Cache sémantique : un profil d'entreprise quasi identique (mêmes enjeux) réutilise l'analyse précédente
+EMBEDDING_MODEL = "text-embedding-3-small"
+SEUIL_SIMILARITE = 0.95
+
+# Clé des enjeux prioritaires saisis pour chaque pilier
+ISSUE_KEYS = {
+    "environnement": "environmental",
+    "social": "social",
+    "gouvernance": "governance"
+}
+
+@ijson.utils.coroutine
+def _enjeux_sink(partial: dict, pilier: str, enjeux: Tuple[str, ...]):
+    """Reconstruit chaque enjeu dans `partial[pilier]` dès que son objet JSON est complet"""
+    builder = None
+    while True:
+        prefix, event, value = (yield)
+        if prefix == 'enjeux.item' and event == 'start_map':
+            builder = ijson.ObjectBuilder()
+        if builder is not None:
+            builder.event(event, value)
+            # Fin de l'élément de la liste "enjeux" : l'enjeu est entièrement reçu
+            if prefix == 'enjeux.item' and event == 'end_map':
+                for nom, enjeu in _par_nom({"enjeux": [builder.value]}, enjeux).items():
+                    partial.setdefault(pilier, {}).setdefault(nom, enjeu)
+                builder = None
+
+def _merge_lots(lots: List[dict]) -> dict:
+    """Regroupe par pilier les enjeux reçus pour chaque lot"""
+    merged = {}
+    for lot in lots:
+        for pilier, enjeux in lot.items():
+            merged.setdefault(pilier, {}).update(enjeux)
+    return merged
+
+@st.cache_resource
+def get_openai_client() -> OpenAI:
+    """Client OpenAI partagé par toutes les sessions (un seul pool de connexions par processus)"""
+    try:
+        api_key = st.secrets["OPENAI_API_KEY"]
+    except KeyError:
+        st.error("❌ Clé API OpenAI non trouvée dans les secrets Streamlit.")
+        st.info("💡 Ajoutez votre clé API dans les secrets Streamlit avec la clé 'OPENAI_API_KEY'")
+        st.stop()
+        
+    # Client HTTP/2 avec pool de connexions persistantes (évite un handshake TLS par requête)
+    http_client = httpx.Client(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+    return OpenAI(api_key=api_key, http_client=http_client, max_retries=MAX_RETRIES)
+
+def get_model() -> str:
+    """Modèle GPT à utiliser (secret OPENAI_MODEL, sinon DEFAULT_MODEL)"""
+    return st.secrets.get("OPENAI_MODEL", DEFAULT_MODEL)
+
 class GPTInterface:
     """Interface avec l'API GPT pour l'analyse CSRD"""
-    
-    def __init__(self):
-        try:
-            self.api_key = st.secrets["OPENAI_API_KEY"]
-        except KeyError:
-            st.error("❌ Clé API OpenAI non trouvée dans les secrets Streamlit.")
-            st.info("💡 Ajoutez votre clé API dans les secrets Streamlit avec la clé 'OPENAI_API_KEY'")
-            st.stop()
-            
-        self.client = OpenAI(api_key=self.api_key)
-
-    def clean_json_string(self, json_str: str) -> str:
-        """Nettoie une chaîne JSON potentiellement mal formée de manière plus robuste"""
-        # Étape 1: Nettoyage des sauts de ligne et espaces problématiques
-        lines = json_str.split('\n')
-        cleaned_lines = []
-        in_string = False
-        escape_next = False
-        
-        for line in lines:
-            cleaned_line = ''
-            for char in line:
-                if char == '\\' and not escape_next:
-                    escape_next = True
-                    cleaned_line += char
+
+    def _async_client(self) -> AsyncOpenAI:
+        """Crée le client asynchrone HTTP/2 (son pool est lié à la boucle d'événements qui l'utilise)"""
+        return AsyncOpenAI(
+            api_key=get_openai_client().api_key,
+            http_client=httpx.AsyncClient(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT),
+            max_retries=MAX_RETRIES
+        )
+
+    async def _generate_lot(self, aclient: AsyncOpenAI, model: str, context: dict, pilier: str, enjeux: Tuple[str, ...],
+                            result: dict, advance: Callable[[], None], show_preview: Callable[[], None],
+                            suivi: Callable[[str, object], None]) -> None:
+        """Analyse un lot d'enjeux d'un pilier (structure puis enrichissement en streaming) et complète `result` au fil de l'eau"""
+        # Premier appel pour la structure
+        first_response = await aclient.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": STRUCTURE_SYSTEM_PROMPT},
+                {"role": "user", "content": self._create_prompt(context, pilier, enjeux)}
+            ],
+            response_format=RESPONSE_FORMAT,
+            temperature=0.5
+        )
+        advance()
+
+        # Deuxième appel pour enrichir chaque enjeu
+        messages = [
+            {"role": "system", "content": ENRICHMENT_SYSTEM_PROMPT},
+            {"role": "assistant", "content": first_response.choices[0].message.content},
+            {"role": "user", "content": ENRICHMENT_USER_PROMPT}
+        ]
+        response_format = RESPONSE_FORMAT
+
+        # Parsing incrémental pendant la réception du flux
+        parser = ijson.parse_coro(_enjeux_sink(result, pilier, enjeux), use_float=True)
+        parse_error = None
+        chunks = []
+        for _ in range(MAX_CONTINUATIONS + 1):
+            response = await aclient.chat.completions.create(
+                model=model,
+                messages=messages,
+                response_format=response_format,
+                temperature=0.7,
+                max_tokens=2000,
+                stream=True
+            )
+            partial = []
+            finish_reason = None
+            async for chunk in response:
+                if not chunk.choices:
                     continue
-                    
-                if char == '"' and not escape_next:
-                    in_string = not in_string
-                    
-                if in_string or char not in ('\n', '\r', '\t'):
-                    cleaned_line += char
-                    
-                escape_next = False
-                
-            cleaned_lines.append(cleaned_line)
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                partial.append(delta)
+                if parse_error is None:
+                    try:
+                        parser.send(delta.encode('utf-8'))
+                    except ijson.JSONError as e:
+                        parse_error = e
+                show_preview()
+            chunks.extend(partial)
+
+            if finish_reason != "length" or parse_error is not None:
+                break
+            # Réponse tronquée par max_tokens : on demande la suite, injectée dans le même parseur.
+            # Le format imposé est désactivé car la suite n'est pas un objet JSON complet.
+            messages = messages + [
+                {"role": "assistant", "content": ''.join(partial)},
+                {"role": "user", "content": CONTINUATION_PROMPT}
+            ]
+            response_format = {"type": "text"}
+
+        if parse_error is None:
+            try:
+                parser.close()
+            except ijson.JSONError as e:
+                parse_error = e
+        advance()
+
+        if parse_error is not None:
+            # Le schéma imposé par l'API garantit un JSON valide : seule une réponse tronquée au-delà des relances échoue ici
+            result.pop(pilier, None)
+            suivi("erreur", f"Réponse JSON invalide pour le pilier {pilier}: {str(parse_error)}")
+            suivi("erreur", "Contenu JSON problématique:")
+            suivi("code", ''.join(chunks))
+
+    async def _generate_all(self, model: str, context: dict, lots: List[Tuple[str, Tuple[str, ...]]], results: List[dict],
+                            advance: Callable[[], None], show_preview: Callable[[], None],
+                            suivi: Callable[[str, object], None]) -> None:
+        """Lance l'analyse des lots en parallèle (un résultat par lot), en limitant le nombre de requêtes simultanées"""
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_LOTS)
+
+        async def generate(aclient: AsyncOpenAI, pilier: str, enjeux: Tuple[str, ...], result: dict) -> None:
+            async with semaphore:
+                try:
+                    await self._generate_lot(aclient, model, context, pilier, enjeux, result, advance, show_preview, suivi)
+                except (OpenAIError, httpx.HTTPError) as e:
+                    # Lot laissé vide (nouvelle tentative) sans interrompre les autres lots
+                    result.clear()
+                    suivi("erreur", f"Erreur de l'API pour {', '.join(enjeux)} ({pilier}) : {str(e)}")
+
+        async with self._async_client() as aclient:
+            await asyncio.gather(*(
+                generate(aclient, pilier, enjeux, result)
+                for (pilier, enjeux), result in zip(lots, results)
+            ))
+
+    def generate_iros(self, context: dict) -> dict:
+        """Génère l'analyse IRO (Impact, Risques, Opportunités), réutilisée pour une saisie identique ou quasi identique"""
+        model = get_model()
+        normalized = _normalize(context)
+        cle = orjson.dumps(normalized, option=orjson.OPT_SORT_KEYS)
+        cle_enjeux = orjson.dumps(normalized['priority_issues'], option=orjson.OPT_SORT_KEYS)
+        cache = st.session_state.semantic_cache
+
+        profil = "\n".join(normalized[champ] for champ in
+                           ('company_description', 'industry_sector', 'business_model', 'specific_features'))
+
+        result = cache.get_exact(cle, model)
+        if result is not None:
+            return result
+
+        # Embedding seulement si une analyse aux enjeux identiques peut être réutilisée
+        embedding = None
+        if cache.has_candidates(cle_enjeux, model):
+            embedding = self._embed(profil)
+            if embedding is not None:
+                result = cache.get_similar(embedding, cle_enjeux, model, self._embed)
+                if result is not None:
+                    st.info("♻️ Profil quasi identique à une analyse précédente : résultats réutilisés")
+                    return result
+
+        try:
+            result, deficiencies = self._run_cached(orjson.dumps(context, option=orjson.OPT_SORT_KEYS), model)
+        except EmptyAnalysisError:
+            return {}
+        except IncompleteAnalysisError as e:
+            st.warning(f"⚠️ Réponse incomplète après {MAX_TENTATIVES} tentatives :\n" + "\n".join(e.rapport))
+            return e.result
+        except Exception as e:
+            st.error(f"Erreur lors de la génération des IRO: {str(e)}")
+            st.error("Détails de l'erreur pour le débogage:")
+            st.exception(e)
+            return {}
+        if deficiencies:
+            st.warning(f"⚠️ Enjeux encore non conformes après {MAX_TENTATIVES} tentatives :\n" + "\n".join(deficiencies))
+        cache.set(cle, cle_enjeux, model, profil, embedding, result)
+        return result
+
+    def _embed(self, profil: str) -> Optional[List[float]]:
+        """Embedding du profil de l'entreprise (None si l'appel échoue : seul le cache exact est alors utilisé)"""
+        try:
+            return get_openai_client().embeddings.create(model=EMBEDDING_MODEL, input=profil).data[0].embedding
+        except OpenAIError:
+            return None
+
+    def _run_cached(self, context_json: bytes, model: str) -> Tuple[dict, List[str]]:
+        """Exécute _cached_generate dans un thread et affiche sa progression depuis le script, hors du cache"""
+        evenements = queue.Queue()
+        progress_bar = st.progress(0)
+        status = st.empty()
+
+        def show_preview(apercu: Dict[str, List[str]]):
+            # Aperçu des enjeux déjà reçus pendant que la génération se poursuit
+            with status.container():
+                st.caption(f"{sum(len(noms) for noms in apercu.values())} enjeu(x) analysé(s)...")
+                for pilier_id, pilier_name in PILLARS:
+                    if apercu.get(pilier_id):
+                        st.markdown(f"**{pilier_name}**\n" + "\n".join(f"- {enjeu}" for enjeu in apercu[pilier_id]))
+
+        afficher = {
+            "progression": progress_bar.progress,
+            "apercu": show_preview,
+            "avertissement": st.warning,
+            "erreur": st.error,
+            "code": st.code
+        }
+        try:
+            # Le spinner s'affiche aussi pendant l'attente du calcul en cours d'une saisie identique (autre session)
+            with st.spinner("Analyse des impacts, risques et opportunités en cours..."), \
+                    ThreadPoolExecutor(max_workers=1) as executor:
+                calcul = executor.submit(_cached_generate, context_json, model,
+                                         lambda genre, valeur: evenements.put((genre, valeur)))
+                while not (calcul.done() and evenements.empty()):
+                    try:
+                        genre, valeur = evenements.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    afficher[genre](valeur)
+                return calcul.result()
+        finally:
+            progress_bar.empty()
+            status.empty()
+
+    def _generate_iros(self, context: dict, model: str,
+                       suivi: Callable[[str, object], None]) -> Tuple[dict, List[str], List[str]]:
+        """Génère l'analyse IRO via GPT sans rien afficher (progression transmise à `suivi`), avec les lots sans résultat et les enjeux non conformes"""
+        lots = _lots(context)
         
-        cleaned = ' '.join(cleaned_lines)
+        lot_results = [{} for _ in lots]
+        etapes = 0
+        total_etapes = 2 * len(lots)
+        nb_enjeux = 0
         
-        # Étape 2: Équilibrage des guillemets
-        quote_positions = []
-        backslash_positions = []
-        for i, char in enumerate(cleaned):
-            if char == '\\':
-                backslash_positions.append(i)
-            elif char == '"' and i-1 not in backslash_positions:
-                quote_positions.append(i)
+        def advance():
+            # Deux étapes par lot : structure puis enrichissement
+            nonlocal etapes
+            etapes += 1
+            suivi("progression", int(100 * etapes / total_etapes))
         
-        # Si nombre impair de guillemets, ajout d'un guillemet final
-        if len(quote_positions) % 2 != 0:
-            last_quote = quote_positions[-1]
-            next_brace = cleaned.find('}', last_quote)
-            if next_brace != -1:
-                cleaned = cleaned[:next_brace] + '"' + cleaned[next_brace:]
-            else:
-                cleaned += '"'
+        def show_preview():
+            nonlocal nb_enjeux
+            recus = sum(len(enjeux) for lot in lot_results for enjeux in lot.values())
+            if recus != nb_enjeux:
+                nb_enjeux = recus
+                suivi("apercu", {pilier: list(enjeux) for pilier, enjeux in _merge_lots(lot_results).items()})
         
-        # Étape 3: Équilibrage des accolades
-        stack = []
-        for i, char in enumerate(cleaned):
-            if char == '{':
-                stack.append(char)
-            elif char == '}':
-                if stack:
-                    stack.pop()
-                
-        # Ajout des accolades manquantes
-        cleaned += '}' * len(stack)
+        a_generer = list(range(len(lots)))
+        for tentative in range(1, MAX_TENTATIVES + 1):
+            asyncio.run(self._generate_all(model, context, [lots[i] for i in a_generer],
+                                           [lot_results[i] for i in a_generer], advance, show_preview, suivi))
+
+            # Validation stricte du nombre d'éléments, avec un rapport unique pour tous les enjeux
+            echecs = []
+            deficiencies = []
+            rejetes = []
+            for i in a_generer:
+                if not lot_results[i]:
+                    # Lot sans résultat : réponse JSON invalide ou erreur de l'API
+                    echecs.append(f"- {', '.join(lots[i][1])} : aucun résultat exploitable")
+                    rejetes.append(i)
+                for pilier, enjeux in lot_results[i].items():
+                    for enjeu, details in enjeux.items():
+                        try:
+                            EnjeuModel.model_validate(details)
+                        except ValidationError as e:
+                            erreur = e.errors()[0]
+                            parent = erreur["loc"][:-1] if erreur["type"] == "missing" else erreur["loc"]
+                            champ = ".".join(str(cle) for cle in parent) or "enjeu"
+                            if erreur["type"] == "too_short":
+                                probleme = f"moins de 5 éléments ({champ})"
+                            elif erreur["type"] == "missing":
+                                manquants = [str(err["loc"][-1]) for err in e.errors()
+                                             if err["type"] == "missing" and err["loc"][:-1] == parent]
+                                probleme = f"{', '.join(manquants)} manquant(s) ({champ})"
+                            else:
+                                probleme = f"structure invalide ({champ})"
+                            deficiencies.append(f"- {enjeu} : {probleme}")
+                            if i not in rejetes:
+                                rejetes.append(i)
+            if not rejetes or tentative == MAX_TENTATIVES:
+                break
+
+            # Nouvelle tentative limitée aux lots rejetés
+            suivi("avertissement", "❌ Réponse rejetée, nouvelle tentative :\n" + "\n".join(echecs + deficiencies))
+            a_generer = rejetes
+            for i in a_generer:
+                lot_results[i] = {}
+            total_etapes += 2 * len(a_generer)
+
+        return _merge_lots(lot_results), echecs, deficiencies
+
+    def submit_batch(self, context: dict) -> Optional[str]:
+        """Soumet l'analyse à l'API Batch d'OpenAI (une requête par lot d'enjeux) et renvoie l'identifiant du batch"""
+        lines = []
+        for numero, (pilier_id, enjeux) in enumerate(_lots(context), 1):
+            lines.append(orjson.dumps({
+                "custom_id": f"{pilier_id}-{numero}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": get_model(),
+                    "messages": [
+                        BATCH_SYSTEM_MESSAGE,
+                        {"role": "user", "content": self._create_prompt(context, pilier_id, enjeux)}
+                    ],
+                    "response_format": RESPONSE_FORMAT,
+                    "temperature": 0.7,
+                    "max_tokens": 4000
+                }
+            }))
         
-        # Étape 4: Validation finale de la structure
         try:
-            # Tentative de parse pour vérifier la validité
-            json.loads(cleaned)
-            return cleaned
-        except json.JSONDecodeError as e:
-            # Si erreur, tentative de correction supplémentaire
-            if "Expecting ',' delimiter" in str(e):
-                pos = int(str(e).split('char ')[-1].strip())
-                cleaned = cleaned[:pos] + ',' + cleaned[pos:]
-                
-            # Vérification des objets non fermés
-            if cleaned.count('{') > cleaned.count('}'):
-                cleaned += '}' * (cleaned.count('{') - cleaned.count('}'))
-            
-            return cleaned
+            batch_file = get_openai_client().files.create(
+                file=("analyse_csrd_batch.jsonl", b"\n".join(lines)),
+                purpose="batch"
+            )
+            batch = get_openai_client().batches.create(
+                input_file_id=batch_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
+            return batch.id
+        except Exception as e:
+            st.error(f"Erreur lors de la soumission du batch: {str(e)}")
+            st.exception(e)
+            return None
 
-    def generate_iros(self, context: dict) -> dict:
-        """Génère l'analyse IRO (Impact, Risques, Opportunités) via GPT"""
-        prompt = self._create_prompt(context)
+    def retrieve_batch(self, batch_id: str, lots: List[Tuple[str, Tuple[str, ...]]]) -> Optional[dict]:
+        """Récupère les résultats d'un batch, fusionnés par pilier (None tant que le batch est en cours ou injoignable)"""
+        try:
+            batch = get_openai_client().batches.retrieve(batch_id)
+            if batch.status in ("validating", "in_progress", "finalizing"):
+                st.info(f"⏳ Analyse batch en cours ({batch.status}), vérifiez à nouveau le statut plus tard.")
+                return None
+            if batch.status != "completed" or not batch.output_file_id:
+                st.error(f"❌ Le batch {batch_id} s'est terminé sans résultat (statut : {batch.status})")
+                return {}
+            output = get_openai_client().files.content(batch.output_file_id).content
+        except OpenAIError as e:
+            # batch_id conservé : l'utilisateur peut vérifier à nouveau le statut
+            st.error(f"Erreur lors de la récupération du batch: {str(e)}")
+            return None
         
-        with st.spinner('Analyse des impacts, risques et opportunités en cours...'):
-            progress_bar = st.progress(0)
+        result = {}
+        for line in output.splitlines():
+            item = orjson.loads(line)
+            pilier_id, numero = item["custom_id"].split("-", 1)
+            response = item.get("response") or {}
+            if response.get("status_code") != 200:
+                st.warning(f"Requête batch en échec pour le pilier {pilier_id}")
+                continue
             try:
-                # Premier appel pour la structure
-                first_response = self.client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": """Vous êtes un expert en reporting CSRD. Pour chacun des enjeux mentionnés, 
-                        identifiez UNIQUEMENT les grands domaines d'impact, sans les détailler. 
-                        Votre rôle est d'établir une première structure qui sera enrichie ensuite."""},
-                        {"role": "user", "content": prompt}
-                    ],
-                    response_format={"type": "json_object"},
-                    temperature=0.5
-                )
-
-                progress_bar.progress(33)
-
-                # Deuxième appel pour enrichir chaque enjeu
-                response = self.client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": """Vous êtes un expert en reporting CSRD spécialisé dans l'analyse exhaustive.
-                        RÈGLE ABSOLUE: Pour chaque catégorie (impacts positifs, impacts négatifs, risques, opportunités), 
-                        vous DEVEZ fournir entre 5 et 10 éléments.
-                        La réponse sera rejetée si elle contient moins de 5 éléments par catégorie.
-                        
-                        Chaque élément doit être :
-                        1. Détaillé et explicite (pas de descriptions vagues)
-                        2. Spécifique à l'enjeu traité
-                        3. Actionnable et mesurable quand applicable"""},
-                        {"role": "assistant", "content": first_response.choices[0].message.content},
-                        {"role": "user", "content": """Enrichissez CHAQUE enjeu avec au minimum 5 éléments par catégorie.
-                        
-                        FORMAT STRICT À RESPECTER:
-                        - Au moins 5 impacts positifs par enjeu
-                        - Au moins 5 impacts négatifs par enjeu
-                        - Au moins 5 risques identifiés par enjeu
-                        - Au moins 5 mesures d'atténuation par enjeu
-                        - Au moins 5 opportunités par enjeu
-                        - Au moins 5 actions proposées par enjeu
-                        
-                        ATTENTION: Je refuse catégoriquement toute réponse avec moins de 5 éléments par catégorie.
-                        
-                        Les datapoints CSRD doivent TOUS citer les paragraphes de référence de la CSRD."""}
-                    ],
-                    response_format={"type": "json_object"},
-                    temperature=0.7,
-                    max_tokens=4000
-                )
+                content = orjson.loads(response["body"]["choices"][0]["message"]["content"])
+            except orjson.JSONDecodeError as e:
+                st.warning(f"Réponse JSON invalide pour le pilier {pilier_id}: {str(e)}")
+                continue
+            result.setdefault(pilier_id, {}).update(_par_nom(content, lots[int(numero) - 1][1]))
+        return result
 
-                progress_bar.progress(66)
-                raw_content = response.choices[0].message.content
+    def _create_prompt(self, context: dict, pilier: str, enjeux: Tuple[str, ...]) -> str:
+        """Crée le message utilisateur, limité au contexte de l'entreprise et à un lot d'enjeux d'un pilier"""
+        return _build_user_prompt(
+            context['company_description'], context['industry_sector'], context['business_model'],
+            context['specific_features'], pilier, orjson.dumps(enjeux).decode()
+        )
 
-                try:
-                    # Premier essai avec le JSON brut
-                    result = json.loads(raw_content)
-                except json.JSONDecodeError as e:
-                    st.warning(f"Tentative de réparation du JSON... Erreur initiale: {str(e)}")
-                    
-                    # Tentative de nettoyage et nouveau parse
-                    cleaned_content = self.clean_json_string(raw_content)
-                    try:
-                        result = json.loads(cleaned_content)
-                    except json.JSONDecodeError as e2:
-                        st.error(f"Impossible de réparer le JSON: {str(e2)}")
-                        st.error("Contenu JSON problématique:")
-                        st.code(raw_content)
-                        return {}
+def _lots(context: dict) -> List[Tuple[str, Tuple[str, ...]]]:
+    """Découpe les enjeux saisis (un par ligne ou séparés par « ; ») en lots de ENJEUX_PAR_REQUETE par pilier"""
+    lots = []
+    for pilier_id, _ in PILLARS:
+        texte = context['priority_issues'][ISSUE_KEYS[pilier_id]]
+        # Puce retirée seulement si elle est suivie d'un espace (« -10% émissions » reste intact)
+        enjeux = [re.sub(r"^[-•*](\s+|$)", "", ligne.strip()) for ligne in texte.replace(";", "\n").splitlines()]
+        enjeux = [enjeu for enjeu in enjeux if enjeu]
+        for debut in range(0, len(enjeux), ENJEUX_PAR_REQUETE):
+            lots.append((pilier_id, tuple(enjeux[debut:debut + ENJEUX_PAR_REQUETE])))
+    return lots
 
-                progress_bar.progress(100)
+def _normalize(context: dict) -> dict:
+    """Contexte aux espaces normalisés, pour que des saisies ne différant que par la mise en forme coïncident"""
+    return {
+        cle: _normalize(valeur) if isinstance(valeur, dict)
+        else "\n".join(" ".join(ligne.split()) for ligne in valeur.splitlines() if ligne.strip())
+        for cle, valeur in context.items()
+    }
 
-                # Validation stricte du nombre d'éléments
-                for pilier, enjeux in result.items():
-                    for enjeu, details in enjeux.items():
-                        if len(details.get('impacts', {}).get('positifs', [])) < 5:
-                            st.error(f"❌ Réponse rejetée : moins de 5 impacts positifs pour {enjeu}")
-                            return self.generate_iros(context)  # Nouvelle tentative
-                        if len(details.get('impacts', {}).get('negatifs', [])) < 5:
-                            st.error(f"❌ Réponse rejetée : moins de 5 impacts négatifs pour {enjeu}")
-                            return self.generate_iros(context)  # Nouvelle tentative
-                        if len(details.get('risques', {}).get('liste', [])) < 5:
-                            st.error(f"❌ Réponse rejetée : moins de 5 risques pour {enjeu}")
-                            return self.generate_iros(context)  # Nouvelle tentative
-                        if len(details.get('risques', {}).get('mesures_attenuation', [])) < 5:
-                            st.error(f"❌ Réponse rejetée : moins de 5 mesures d'atténuation pour {enjeu}")
-                            return self.generate_iros(context)  # Nouvelle tentative
-                        if len(details.get('opportunites', {}).get('liste', [])) < 5:
-                            st.error(f"❌ Réponse rejetée : moins de 5 opportunités pour {enjeu}")
-                            return self.generate_iros(context)  # Nouvelle tentative
-                        if len(details.get('opportunites', {}).get('actions_saisie', [])) < 5:
-                            st.error(f"❌ Réponse rejetée : moins de 5 actions pour {enjeu}")
-                            return self.generate_iros(context)  # Nouvelle tentative
-
-                return result
-
-            except Exception as e:
-                st.error(f"Erreur lors de la génération des IRO: {str(e)}")
-                st.error("Détails de l'erreur pour le débogage:")
-                st.exception(e)
-                return {}
-            finally:
-                progress_bar.empty()
+@dataclass
+class _EntreeCache:
+    """Analyse mémorisée, dont l'embedding du profil n'est calculé qu'au premier rapprochement"""
+    cle: bytes
+    cle_enjeux: bytes
+    model: str
+    profil: str
+    embedding: Optional[List[float]]
+    result: dict
 
-    def _create_prompt(self, context: dict) -> str:
-        """Crée le prompt pour l'analyse CSRD"""
-        return f"""
-        En tant qu'expert CSRD, analysez TOUS les enjeux mentionnés dans les textes fournis.
-        Pour CHAQUE enjeu mentionné, vous devez fournir une analyse complète des impacts, risques et opportunités.
+class SemanticCache:
+    """Analyses de la session, retrouvées à l'identique ou par similarité du profil d'entreprise"""
 
-        PROFIL DE L'ENTREPRISE:
-        {context['company_description']}
+    def __init__(self, max_entries: int = 20):
+        self.max_entries = max_entries
+        self.entries: List[_EntreeCache] = []
 
-        SECTEUR D'ACTIVITÉ:
-        {context['industry_sector']}
+    def get_exact(self, cle: bytes, model: str) -> Optional[dict]:
+        for entree in self.entries:
+            if entree.cle == cle and entree.model == model:
+                return entree.result
+        return None
 
-        MODÈLE D'AFFAIRES:
-        {context['business_model']}
+    def has_candidates(self, cle_enjeux: bytes, model: str) -> bool:
+        """Vrai si une analyse aux enjeux identiques existe pour ce modèle"""
+        return any(entree.cle_enjeux == cle_enjeux and entree.model == model for entree in self.entries)
 
-        CARACTÉRISTIQUES SPÉCIFIQUES:
-        {context['specific_features']}
+    def get_similar(self, embedding: List[float], cle_enjeux: bytes, model: str,
+                    embed: Callable[[str], Optional[List[float]]]) -> Optional[dict]:
+        """Meilleure analyse aux enjeux identiques dont le profil dépasse SEUIL_SIMILARITE"""
+        meilleur, meilleure_similarite = None, SEUIL_SIMILARITE
+        for entree in self.entries:
+            if entree.cle_enjeux != cle_enjeux or entree.model != model:
+                continue
+            if entree.embedding is None:
+                entree.embedding = embed(entree.profil)
+                if entree.embedding is None:
+                    continue
+            # Les embeddings OpenAI sont normés : le produit scalaire est la similarité cosinus
+            similarite = sum(a * b for a, b in zip(embedding, entree.embedding))
+            if similarite >= meilleure_similarite:
+                meilleur, meilleure_similarite = entree.result, similarite
+        return meilleur
 
-        ENJEUX À ANALYSER:
-        [IMPORTANT: Analyser TOUS les enjeux mentionnés ci-dessous]
-        
-        Environnement: {context['priority_issues']['environmental']}
-        Social: {context['priority_issues']['social']}
-        Gouvernance: {context['priority_issues']['governance']}
-
-        Format JSON STRICT à respecter:
-        {{
-            "environnement": {{
-                "nom_enjeu_1": {{
-                    "description": "Description détaillée de l'enjeu",
-                    "impacts": {{
-                        "positifs": [
-                            "Premier impact positif détaillé",
-                            "Deuxième impact positif détaillé",
-                            "Troisième impact positif détaillé",
-                            "Quatrième impact positif détaillé",
-                            "Cinquième impact positif détaillé",
-                            "Sixième impact positif si pertinent",
-                            "Septième impact positif si pertinent",
-                            "Huitième impact positif si pertinent",
-                            "Neuvième impact positif si pertinent",
-                            "Dixième impact positif si pertinent"
-                        ],
-                        "negatifs": [
-                            "Premier impact négatif détaillé",
-                            "Deuxième impact négatif détaillé",
-                            "Troisième impact négatif détaillé",
-                            "Quatrième impact négatif détaillé",
-                            "Cinquième impact négatif détaillé",
-                            "Sixième impact négatif si pertinent",
-                            "Septième impact négatif si pertinent",
-                            "Huitième impact négatif si pertinent",
-                            "Neuvième impact négatif si pertinent",
-                            "Dixième impact négatif si pertinent"
-                        ]
-                    }},
-                    "risques": {{
-                        "liste": [
-                            "Premier risque identifié et détaillé",
-                            "Deuxième risque identifié et détaillé",
-                            "Troisième risque identifié et détaillé",
-                            "Quatrième risque identifié et détaillé",
-                            "Cinquième risque identifié et détaillé",
-                            "Sixième risque si pertinent",
-                            "Septième risque si pertinent",
-                            "Huitième risque si pertinent",
-                            "Neuvième risque si pertinent",
-                            "Dixième risque si pertinent"
-                        ],
-                        "niveau": "Élevé/Moyen/Faible",
-                        "horizon": "Court/Moyen/Long terme",
-                        "mesures_attenuation": [
-                            "Première mesure d'atténuation détaillée",
-                            "Deuxième mesure d'atténuation détaillée",
-                            "Troisième mesure d'atténuation détaillée",
-                            "Quatrième mesure d'atténuation détaillée",
-                            "Cinquième mesure d'atténuation détaillée",
-                            "Sixième mesure si pertinente",
-                            "Septième mesure si pertinente",
-                            "Huitième mesure si pertinente",
-                            "Neuvième mesure si pertinente",
-                            "Dixième mesure si pertinente"
-                        ]
-                    }},
-                    "opportunites": {{
-                        "liste": [
-                            "Première opportunité identifiée et détaillée",
-                            "Deuxième opportunité identifiée et détaillée",
-                            "Troisième opportunité identifiée et détaillée",
-                            "Quatrième opportunité identifiée et détaillée",
-                            "Cinquième opportunité identifiée et détaillée",
-                            "Sixième opportunité si pertinente",
-                            "Septième opportunité si pertinente",
-                            "Huitième opportunité si pertinente",
-                            "Neuvième opportunité si pertinente",
-                            "Dixième opportunité si pertinente"
-                        ],
-                        "potentiel": "Élevé/Moyen/Faible",
-                        "horizon": "Court/Moyen/Long terme",
-                        "actions_saisie": [
-                            "Première action proposée et détaillée",
-                            "Deuxième action proposée et détaillée",
-                            "Troisième action proposée et détaillée",
-                            "Quatrième action proposée et détaillée",
-                            "Cinquième action proposée et détaillée",
-                            "Sixième action si pertinente",
-                            "Septième action si pertinente",
-                            "Huitième action si pertinente",
-                            "Neuvième action si pertinente",
-                            "Dixième action si pertinente"
-                        ]
-                    }},
-                    "datapoints_csrd": [
-                        {{
-                            "indicateur": "Nom du datapoint",
-                            "type": "KPI quantitatif ou texte narratif",
-                            "reference_csrd": "Paragraphe CSRD correspondant",
-                            "description": "Description du datapoint",
-                            "methodologie": "Méthodologie de collecte/calcul",
-                            "frequence": "Fréquence de mesure",
-                            "objectifs": {{
-                                "court_terme": "Objectif à 1 an",
-                                "moyen_terme": "Objectif à 3 ans",
-                                "long_terme": "Objectif à 5 ans"
-                            }}
-                        }}
-                    ]
-                }}
-            }},
-            "social": {{ ... }},
-            "gouvernance": {{ ... }}
-        }}
-
-        ATTENTION:
-        - Vous DEVEZ traiter ABSOLUMENT TOUS les enjeux mentionnés
-        - Pour chaque enjeu, fournissez AU MINIMUM 5 éléments pour chaque catégorie
-        - Le nombre d'éléments doit être adapté à l'importance de l'enjeu (jusqu'à 10 par catégorie)
-        - Chaque élément doit être détaillé et spécifique à l'enjeu
-        - Citez les paragraphes CSRD pour chaque datapoint
-        - Ne limitez PAS le nombre d'enjeux traités
-        - Assurez-vous que la réponse est un JSON valide et complet
-        """
+    def set(self, cle: bytes, cle_enjeux: bytes, model: str, profil: str,
+            embedding: Optional[List[float]], result: dict):
+        self.entries.append(_EntreeCache(cle, cle_enjeux, model, profil, embedding, result))
+        del self.entries[:-self.max_entries]
+
+class EmptyAnalysisError(Exception):
+    """Analyse sans résultat, à ne pas mettre en cache"""
+
+class IncompleteAnalysisError(Exception):
+    """Analyse dont au moins un lot a échoué, renvoyée sans mise en cache avec le rapport des lots et enjeux en défaut"""
+
+    def __init__(self, result: dict, rapport: List[str]):
+        super().__init__()
+        self.result = result
+        self.rapport = rapport
+
+# Aucun appel à l'interface ici : st.cache_data rejouerait les éléments affichés à chaque lecture du cache.
+# La progression passe par `_suivi` (exclu de la clé) et les avertissements sont renvoyés comme données.
+@st.cache_data(show_spinner=False, ttl=86400, max_entries=64)
+def _cached_generate(context_json: bytes, model: str, _suivi: Callable[[str, object], None]) -> Tuple[dict, List[str]]:
+    """Analyse IRO mise en cache sur le contexte sérialisé et le modèle, avec les enjeux encore non conformes"""
+    result, echecs, deficiencies = GPTInterface()._generate_iros(orjson.loads(context_json), model, _suivi)
+    if echecs:
+        raise IncompleteAnalysisError(result, echecs + deficiencies)
+    if not result:
+        raise EmptyAnalysisError()
+    return result, deficiencies
 
 def company_profile_section():
     """Section pour la description détaillée de l'entreprise"""
@@ -396,7 +710,7 @@ def priority_issues_section():
     """Section pour identifier les enjeux prioritaires"""
     st.header("🎯 Enjeux prioritaires")
     
-    st.info("Identifiez et décrivez les enjeux ESG prioritaires pour votre entreprise")
+    st.info("Identifiez et décrivez les enjeux ESG prioritaires pour votre entreprise (un enjeu par ligne ou séparés par « ; »)")
     
     environmental_issues = st.text_area(
         "Enjeux environnementaux",
@@ -422,6 +736,125 @@ def priority_issues_section():
         "governance": governance_issues
     }
 
+def _vue(model: type, data) -> BaseModel:
+    """Construit `model` sans validation à partir d'une réponse partielle, en suivant ses champs (texte absent à None, liste absente vide)"""
+    data = data if isinstance(data, dict) else {}
+    valeurs = {}
+    for champ, info in model.model_fields.items():
+        valeur = data.get(champ)
+        if isinstance(info.annotation, type) and issubclass(info.annotation, BaseModel):
+            valeurs[champ] = _vue(info.annotation, valeur)
+        elif get_origin(info.annotation) is list:
+            element = get_args(info.annotation)[0]
+            valeur = valeur if isinstance(valeur, list) else []
+            if isinstance(element, type) and issubclass(element, BaseModel):
+                # Un élément qui n'est pas un objet est conservé à None pour signaler le format invalide
+                valeur = [_vue(element, item) if isinstance(item, dict) else None for item in valeur]
+            else:
+                # Liste de textes : éléments nuls retirés, autres convertis (l'export les joint)
+                valeur = [str(item) for item in valeur if item is not None]
+            valeurs[champ] = valeur
+        else:
+            valeurs[champ] = valeur
+    return model.model_construct(**valeurs)
+
+def parse_results(results: Dict) -> Dict[str, List[EnjeuNomme]]:
+    """Convertit les résultats bruts en enjeux typés, par pilier"""
+    parsed = {}
+    for pilier_id, _ in PILLARS:
+        enjeux = []
+        for nom, details in (results.get(pilier_id) or {}).items():
+            details = {**details, "nom": nom} if isinstance(details, dict) else {"nom": nom}
+            try:
+                enjeux.append(EnjeuNomme.model_validate(details))
+            except ValidationError:
+                # Réponse partielle (encore rejetée après MAX_TENTATIVES, ou issue du batch) : affichée telle quelle
+                enjeux.append(_vue(EnjeuNomme, details))
+        if pilier_id in results:
+            parsed[pilier_id] = enjeux
+    return parsed
+
+# Colonnes de la feuille "Enjeux", dans l'ordre des tuples construits par _prepare_export
+ENJEU_COLUMNS = (
+    "ID Enjeu", "Pilier", "Enjeu", "Description Enjeu",
+    "Impacts Positifs", "Impacts Négatifs",
+    "Risques", "Niveau Risque", "Horizon Risque", "Mesures Atténuation",
+    "Opportunités", "Potentiel Opportunité", "Horizon Opportunité", "Actions Saisie"
+)
+
+# Colonnes de la feuille "Datapoints" : champ aplati par json_normalize -> libellé Excel
+DATAPOINT_COLUMNS = {
+    "ID Enjeu": "ID Enjeu",
+    "Enjeu": "Enjeu",
+    "indicateur": "Datapoint",
+    "type": "Type",
+    "description": "Description Datapoint",
+    "methodologie": "Méthodologie",
+    "frequence": "Fréquence",
+    "objectifs.court_terme": "Objectif CT",
+    "objectifs.moyen_terme": "Objectif MT",
+    "objectifs.long_terme": "Objectif LT"
+}
+DATAPOINT_DISPLAY_COLUMNS = list(DATAPOINT_COLUMNS)[2:]
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _prepare_export(results_json: bytes) -> bytes:
+    """Construit le fichier Excel de l'analyse, recalculé uniquement quand les résultats changent"""
+    results = parse_results(orjson.loads(results_json))
+    
+    # Une ligne par enjeu, une ligne par datapoint rattachée via "ID Enjeu"
+    enjeu_rows = []
+    datapoint_records = []
+    
+    for pilier_id, pilier_name in PILLARS:
+        for enjeu in results.get(pilier_id, []):
+            enjeu_id = len(enjeu_rows) + 1
+            enjeu_rows.append((
+                enjeu_id,
+                pilier_name,
+                enjeu.nom,
+                enjeu.description,
+                ", ".join(enjeu.impacts.positifs),
+                ", ".join(enjeu.impacts.negatifs),
+                ", ".join(enjeu.risques.liste),
+                enjeu.risques.niveau,
+                enjeu.risques.horizon,
+                ", ".join(enjeu.risques.mesures_attenuation),
+                ", ".join(enjeu.opportunites.liste),
+                enjeu.opportunites.potentiel,
+                enjeu.opportunites.horizon,
+                ", ".join(enjeu.opportunites.actions_saisie)
+            ))
+            
+            datapoint_records.append({
+                "ID Enjeu": enjeu_id,
+                "Enjeu": enjeu.nom,
+                "datapoints_csrd": [
+                    datapoint.model_dump() for datapoint in enjeu.datapoints_csrd if datapoint is not None
+                ]
+            })
+    
+    if not enjeu_rows:
+        return b""
+    
+    buffer = io.BytesIO()
+    # strings_to_urls désactivé : pas de détection d'URL dans chaque texte généré.
+    # Pas de constant_memory : to_excel écrit colonne par colonne, ce mode perdrait toutes les lignes sauf la dernière.
+    with pd.ExcelWriter(buffer, engine='xlsxwriter',
+                        engine_kwargs={'options': {'strings_to_urls': False}}) as writer:
+        pd.DataFrame.from_records(enjeu_rows, columns=ENJEU_COLUMNS).to_excel(writer, index=False, sheet_name='Enjeux')
+        datapoints_df = pd.json_normalize(datapoint_records, record_path="datapoints_csrd", meta=["ID Enjeu", "Enjeu"])
+        datapoints_df = datapoints_df.reindex(columns=list(DATAPOINT_COLUMNS)).rename(columns=DATAPOINT_COLUMNS).fillna('')
+        datapoints_df.to_excel(writer, index=False, sheet_name='Datapoints')
+    return buffer.getvalue()
+
+def _bullets(items: List[str], titre: str = "") -> None:
+    """Affiche une liste à puces (précédée de son titre éventuel) en un seul élément Markdown"""
+    liste = "\n".join(f"- {item}" for item in items) if items else "_Aucun_"
+    st.markdown(f"{titre}\n{liste}" if titre else liste)
+
+# Fragment : cocher « Afficher/Masquer tous les détails » ne réexécute que l'affichage des résultats
+@st.fragment
 def display_results(results: Dict):
     """Affiche les résultats de l'analyse"""
     st.header("📊 Analyse CSRD détaillée")
@@ -431,162 +864,100 @@ def display_results(results: Dict):
         return
 
     # Option pour afficher les détails
-    show_details = st.checkbox("Afficher/Masquer tous les détails", value=True)
+    show_details = st.checkbox("Afficher/Masquer tous les détails", value=False)
     
-    # Définition des piliers
-    pillars = {
-        "environnement": "🌍 Environnement",
-        "social": "👥 Social",
-        "gouvernance": "⚖️ Gouvernance"
-    }
+    vue = parse_results(results)
     
     # Création des tabs avec compteurs
-    tab_names = [f"{name} ({len(results.get(pid, {}))} enjeux)" 
-                 for pid, name in pillars.items()]
+    tab_names = [f"{name} ({len(vue.get(pid, []))} enjeux)" 
+                 for pid, name in PILLARS]
     tabs = st.tabs(tab_names)
     
-    rows = []  # Pour l'export Excel
-    
-    for (pilier_id, pilier_name), tab in zip(pillars.items(), tabs):
-        if pilier_id in results:
+    for (pilier_id, pilier_name), tab in zip(PILLARS, tabs):
+        if pilier_id in vue:
             with tab:
-                for enjeu, details in results[pilier_id].items():
-                    with st.expander(f"🎯 Enjeu : {enjeu}", expanded=show_details):
+                for enjeu in vue[pilier_id]:
+                    with st.expander(f"🎯 Enjeu : {enjeu.nom}", expanded=show_details):
                         # Description
-                        if "description" in details:
+                        if enjeu.description:
                             st.markdown("### 📝 Description")
-                            st.write(details["description"])
+                            st.write(enjeu.description)
                         
                         col1, col2 = st.columns(2)
                         
                         with col1:
                             # Impacts
                             st.markdown("### 💫 Impacts")
-                            if "impacts" in details:
-                                st.markdown("#### ✅ Impacts positifs")
-                                if "positifs" in details["impacts"]:
-                                    for impact in details["impacts"]["positifs"]:
-                                        st.write(f"- {impact}")
-                                
-                                st.markdown("#### ❌ Impacts négatifs")
-                                if "negatifs" in details["impacts"]:
-                                    for impact in details["impacts"]["negatifs"]:
-                                        st.write(f"- {impact}")
+                            st.markdown("#### ✅ Impacts positifs")
+                            _bullets(enjeu.impacts.positifs)
+                            
+                            st.markdown("#### ❌ Impacts négatifs")
+                            _bullets(enjeu.impacts.negatifs)
                             
                             # Risques
                             st.markdown("### ⚠️ Risques")
-                            if "risques" in details:
-                                if "niveau" in details["risques"]:
-                                    st.write(f"**Niveau de risque :** {details['risques']['niveau']}")
-                                if "horizon" in details["risques"]:
-                                    st.write(f"**Horizon :** {details['risques']['horizon']}")
-                                if "liste" in details["risques"]:
-                                    st.markdown("**Risques identifiés :**")
-                                    for risque in details["risques"]["liste"]:
-                                        st.write(f"- {risque}")
-                                if "mesures_attenuation" in details["risques"]:
-                                    st.markdown("**🛡️ Mesures d'atténuation :**")
-                                    for mesure in details["risques"]["mesures_attenuation"]:
-                                        st.write(f"- {mesure}")
+                            niveaux = [f"**{label} :** {valeur}"
+                                       for valeur, label in [(enjeu.risques.niveau, 'Niveau de risque'), (enjeu.risques.horizon, 'Horizon')] if valeur]
+                            if niveaux:
+                                st.markdown("  \n".join(niveaux))
+                            _bullets(enjeu.risques.liste, "**Risques identifiés :**")
+                            _bullets(enjeu.risques.mesures_attenuation, "**🛡️ Mesures d'atténuation :**")
                         
                         with col2:
                             # Opportunités
                             st.markdown("### 🎯 Opportunités")
-                            if "opportunites" in details:
-                                if "potentiel" in details["opportunites"]:
-                                    st.write(f"**Potentiel :** {details['opportunites']['potentiel']}")
-                                if "horizon" in details["opportunites"]:
-                                    st.write(f"**Horizon :** {details['opportunites']['horizon']}")
-                                if "liste" in details["opportunites"]:
-                                    st.markdown("**Opportunités identifiées :**")
-                                    for opportunite in details["opportunites"]["liste"]:
-                                        st.write(f"- {opportunite}")
-                                if "actions_saisie" in details["opportunites"]:
-                                    st.markdown("**🚀 Actions proposées :**")
-                                    for action in details["opportunites"]["actions_saisie"]:
-                                        st.write(f"- {action}")
+                            niveaux = [f"**{label} :** {valeur}"
+                                       for valeur, label in [(enjeu.opportunites.potentiel, 'Potentiel'), (enjeu.opportunites.horizon, 'Horizon')] if valeur]
+                            if niveaux:
+                                st.markdown("  \n".join(niveaux))
+                            _bullets(enjeu.opportunites.liste, "**Opportunités identifiées :**")
+                            _bullets(enjeu.opportunites.actions_saisie, "**🚀 Actions proposées :**")
                             
                             # Datapoints CSRD
-                            if "datapoints_csrd" in details and isinstance(details["datapoints_csrd"], list):
+                            datapoints = [dp.model_dump() for dp in enjeu.datapoints_csrd if dp is not None]
+                            if enjeu.datapoints_csrd:
                                 st.markdown("### 📊 Datapoints CSRD conseillés")
-                                for idx, datapoint in enumerate(details["datapoints_csrd"], 1):
-                                    if not isinstance(datapoint, dict):
-                                        st.error(f"Format de datapoint invalide pour l'enjeu {enjeu}")
-                                        continue
-                                    
-                                    st.markdown(f"#### 📌 Datapoint {idx}: {datapoint.get('indicateur', 'Non spécifié')}")
-                                    st.write(f"**Type :** {datapoint.get('type', 'Non spécifié')}")
-                                    for field, label in [
-                                        ('description', 'Description'),
-                                        ('methodologie', 'Méthodologie'),
-                                        ('frequence', 'Fréquence')
-                                    ]:
-                                        if field in datapoint:
-                                            st.write(f"**{label} :** {datapoint[field]}")
-                                    
-                                    if "objectifs" in datapoint and isinstance(datapoint["objectifs"], dict):
-                                        st.markdown("**Objectifs :**")
-                                        obj = datapoint["objectifs"]
-                                        for term, label in [
-                                            ('court_terme', 'Court terme'),
-                                            ('moyen_terme', 'Moyen terme'),
-                                            ('long_terme', 'Long terme')
-                                        ]:
-                                            if term in obj:
-                                                st.write(f"- {label} : {obj[term]}")
-
-                                    # Ajout pour l'export Excel
-                                    if isinstance(datapoint.get('objectifs'), dict):
-                                        row_data = {
-                                            "Pilier": pilier_name,
-                                            "Enjeu": enjeu,
-                                            "Datapoint": datapoint.get('indicateur', ''),
-                                            "Type": datapoint.get('type', ''),
-                                            "Description Datapoint": datapoint.get('description', ''),
-                                            "Méthodologie": datapoint.get('methodologie', ''),
-                                            "Fréquence": datapoint.get('frequence', ''),
-                                            "Objectif CT": datapoint['objectifs'].get('court_terme', ''),
-                                            "Objectif MT": datapoint['objectifs'].get('moyen_terme', ''),
-                                            "Objectif LT": datapoint['objectifs'].get('long_terme', ''),
-                                            "Description Enjeu": details.get('description', ''),
-                                            "Impacts Positifs": ", ".join(details.get('impacts', {}).get('positifs', [])),
-                                            "Impacts Négatifs": ", ".join(details.get('impacts', {}).get('negatifs', [])),
-                                            "Risques": ", ".join(details.get('risques', {}).get('liste', [])),
-                                            "Niveau Risque": details.get('risques', {}).get('niveau', ''),
-                                            "Horizon Risque": details.get('risques', {}).get('horizon', ''),
-                                            "Mesures Atténuation": ", ".join(details.get('risques', {}).get('mesures_attenuation', [])),
-                                            "Opportunités": ", ".join(details.get('opportunites', {}).get('liste', [])),
-                                            "Potentiel Opportunité": details.get('opportunites', {}).get('potentiel', ''),
-                                            "Horizon Opportunité": details.get('opportunites', {}).get('horizon', ''),
-                                            "Actions Saisie": ", ".join(details.get('opportunites', {}).get('actions_saisie', []))
-                                        }
-                                        rows.append(row_data)
+                                if len(datapoints) < len(enjeu.datapoints_csrd):
+                                    st.error(f"Format de datapoint invalide pour l'enjeu {enjeu.nom}")
+                                if datapoints:
+                                    # Tableau unique (lignes virtualisées) plutôt qu'un bloc par datapoint
+                                    st.dataframe(
+                                        pd.json_normalize(datapoints)
+                                        .reindex(columns=DATAPOINT_DISPLAY_COLUMNS)
+                                        .rename(columns=DATAPOINT_COLUMNS)
+                                        .fillna('Non spécifié'),
+                                        hide_index=True,
+                                        width="stretch"
+                                    )
     
-    # Export Excel
-    if rows:
-        df = pd.DataFrame(rows)
-        buffer = io.BytesIO()
-        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Analyse CSRD')
-        
+    # Export Excel, généré seulement au clic sur le bouton
+    if any(results.get(pilier_id) for pilier_id, _ in PILLARS):
+        # Ordre d'insertion conservé : l'export suit l'ordre des enjeux affichés
+        results_json = orjson.dumps(results)
         st.download_button(
             label="📥 Télécharger l'analyse complète (Excel)",
-            data=buffer.getvalue(),
+            data=lambda: _prepare_export(results_json),
             file_name=f"analyse_csrd_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
 
 def initialize_session_state():
     """Initialise les variables de session Streamlit"""
-    if 'gpt' not in st.session_state:
-        st.session_state.gpt = GPTInterface()
+    # Vérifie la clé API dès le chargement (client créé une seule fois par processus)
+    get_openai_client()
     if 'results' not in st.session_state:
         st.session_state.results = None
+    if 'batch_id' not in st.session_state:
+        st.session_state.batch_id = None
+        st.session_state.batch_lots = []
+    if 'semantic_cache' not in st.session_state:
+        st.session_state.semantic_cache = SemanticCache()
 
 def main():
     st.title("🎯 Analyseur CSRD - Identification des IRO")
     
     initialize_session_state()
+    gpt = GPTInterface()
     
     with st.sidebar:
         st.header("ℹ️ Guide d'utilisation")
@@ -602,6 +973,12 @@ def main():
         - N'hésitez pas à mentionner les spécificités
         - Pensez à long terme dans l'identification des enjeux
         """)
+        
+        st.header("⚙️ Options")
+        batch_mode = st.checkbox(
+            "Mode batch (50% moins cher)",
+            help="Soumet l'analyse à l'API Batch d'OpenAI : résultats sous 24h au lieu d'une réponse immédiate"
+        )
     
     # Sections principales
     company_profile = company_profile_section()
@@ -609,20 +986,34 @@ def main():
     
     # Bouton d'analyse
     if st.button("🔍 Lancer l'analyse"):
-        if not all([company_profile["company_description"], 
-                   company_profile["industry_sector"],
-                   priority_issues["environmental"] or 
-                   priority_issues["social"] or 
-                   priority_issues["governance"]]):
-            st.error("Veuillez remplir au moins la description de l'entreprise, le secteur d'activité et un enjeu prioritaire")
-            return
-        
         context = {
             **company_profile,
             "priority_issues": priority_issues
         }
         
-        st.session_state.results = st.session_state.gpt.generate_iros(context)
+        # Un enjeu réellement saisi : une saisie faite uniquement de séparateurs (« ; », puces) n'en donne aucun
+        has_issue = bool(_lots(context))
+        if not (company_profile["company_description"]
+                and company_profile["industry_sector"]
+                and has_issue):
+            st.error("Veuillez remplir au moins la description de l'entreprise, le secteur d'activité et un enjeu prioritaire")
+            return
+        
+        if batch_mode:
+            st.session_state.batch_id = gpt.submit_batch(context)
+            st.session_state.batch_lots = _lots(context)
+            if st.session_state.batch_id:
+                st.success(f"✅ Analyse soumise en mode batch (identifiant : {st.session_state.batch_id})")
+        else:
+            st.session_state.results = gpt.generate_iros(context)
+    
+    # Suivi d'une analyse batch en attente : l'API n'est interrogée qu'à la demande, pas à chaque rerun
+    if st.session_state.batch_id:
+        if st.button("🔄 Vérifier le statut du batch", help=f"Identifiant : {st.session_state.batch_id}"):
+            batch_results = gpt.retrieve_batch(st.session_state.batch_id, st.session_state.batch_lots)
+            if batch_results is not None:
+                st.session_state.results = batch_results
+                st.session_state.batch_id = None
         
     # Affichage des résultats
     if st.session_state.results: